@@ -10,6 +10,7 @@ import adafruit_scd4x
 # import simpleio
 # import vectorio
 import board
+import busio
 import displayio
 import microcontroller
 import rtc
@@ -18,8 +19,8 @@ import supervisor
 import terminalio
 import wifi
 from adafruit_bitmap_font import bitmap_font
-from adafruit_display_text import bitmap_label, wrap_text_to_lines
-from adafruit_httpserver import Request, Response, Server
+from adafruit_display_text import bitmap_label
+from adafruit_httpserver import NO_REQUEST, REQUEST_HANDLED_RESPONSE_SENT, ChunkedResponse, Request, Server
 from microcontroller import watchdog as w
 from watchdog import WatchDogMode
 
@@ -30,7 +31,7 @@ w.mode = WatchDogMode.RESET  # Set the mode to reset the device
 
 # When running on esp32, the typing module is not available
 try:
-    from typing import Dict, List, Optional, Tuple
+    from typing import Dict, Generator, Iterable, List, Optional, Tuple
 except ImportError:
     pass
 
@@ -40,6 +41,64 @@ except ImportError:
 
 TZ_OFFSET = 1  # UTC+1
 
+# I2C fast-mode, supported by both BME680 and SCD4X
+I2C_FREQUENCY = 400_000  # Hz
+
+# SCD4X periodic measurement interval is 5 seconds, report an error if no fresh measurement
+# arrives for 3 intervals (e.g. the sensor is unplugged, its NACKs look the same as "no data")
+SCD4X_STALE_TIMEOUT = 15  # seconds
+
+# /metrics is streamed to the client in chunks of at most this size (bytes)
+METRICS_CHUNK_SIZE = 512
+# Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Sensors are polled from the main loop with this period, /metrics only formats the last sample.
+# Matches the SCD4X 5 s measurement interval, so polls rarely end in a "no data" NACK. Each poll also
+# blocks the loop for a BME680 forced-mode reading (~200 ms, gas heater at 320 °C), so polling faster
+# would delay requests more often and the heater would bias temperature and humidity upwards.
+SENSOR_POLL_PERIOD = 5  # seconds
+
+# static HELP/TYPE headers of the microcontroller metrics, they never change between requests.
+# The response is built from bytes and dynamic lines are %-formatted straight into bytes,
+# so nothing is encoded per line or again at send time.
+_MEASUREMENT_TIME_HDR = (
+    b"# HELP microcontroller_measurement_time_seconds Time to measure metrics in seconds\n"
+    b"# TYPE microcontroller_measurement_time_seconds gauge\n"
+)
+_CPU_TEMP_HDR = (
+    b"# HELP microcontroller_cpu_temperature_celsius TemperatuPre in Celsius\n"
+    b"# TYPE microcontroller_cpu_temperature_celsius gauge\n"
+)
+_CPU_FREQ_HDR = (
+    b"# HELP microcontroller_cpu_frequency_hz Frequency in hertz\n"
+    b"# TYPE microcontroller_cpu_frequency_hz gauge\n"
+)
+_LAST_DISCOVERY_HDR = (
+    b"# HELP microcontroller_last_discovery_time_seconds Last discovery time in seconds\n"
+    b"# TYPE microcontroller_last_discovery_time_seconds gauge\n"
+)
+_NEXT_DISCOVERY_HDR = (
+    b"# HELP microcontroller_next_discovery_time_seconds Next discovery time in seconds\n"
+    b"# TYPE microcontroller_next_discovery_time_seconds gauge\n"
+)
+_LAST_SCREEN_UPDATE_HDR = (
+    b"# HELP microcontroller_last_screen_update_time_seconds Last screen update time in seconds\n"
+    b"# TYPE microcontroller_last_screen_update_time_seconds gauge\n"
+)
+_INFO_HDR = b"# HELP microcontroller_info Microcontroller info\n# TYPE microcontroller_info gauge\n"
+_SENSOR_INFO_HDR = b"# HELP sensor_info Sensor info\n# TYPE sensor_info gauge\n"
+_LAST_MEASUREMENT_HDR = b"# HELP last_measurement_time Last measurement time\n# TYPE last_measurement_time gauge\n"
+
+# microcontroller_info labels are fixed per boot, so the whole block is rendered once
+_INFO_LABELS_STR = 'cpu_frequency="%d", board_id="%s", board_name="%s", nvm_bytes_count="%d"' % (
+    microcontroller.cpu.frequency,
+    os.uname().machine,
+    board.board_id,
+    len(microcontroller.nvm),
+)
+_INFO_BLOCK = _INFO_HDR + ("microcontroller_info{%s} 1\n" % _INFO_LABELS_STR).encode()
+
 
 def connect_wifi(ssid: str, password: str) -> "Tuple[socketpool.SocketPool, adafruit_ntp.NTP]":
     print("Connecting to WiFi...")
@@ -73,13 +132,16 @@ class TempHumidityDisplay:
     def __init__(self) -> None:
         self.display = board.DISPLAY
 
-        self.temp_format = "%0.1f° C"
-        self.humidity_format = "%0.1f %%"
-        self.pressure_format = "%0.2f"
+        # bound format methods, so the format string is not parsed on every update
+        self.temp_format = "{:.1f}° C".format
+        self.humidity_format = "{:.1f} %".format
+        self.pressure_format = "{:.2f}".format
 
         #  bitmap font
         font_file = "/roundedHeavy-26.bdf"
         font = bitmap_font.load_font(font_file)
+        # BDF glyphs are parsed from flash on first use, preload the only ones the value labels render
+        font.load_glyphs("0123456789.-° C%")
 
         #  text elements
         self.temp_text = bitmap_label.Label(font, text="", x=20, y=80, color=0xFFFFFF)
@@ -89,6 +151,14 @@ class TempHumidityDisplay:
         self.ip_address_text = bitmap_label.Label(terminalio.FONT, text="", x=12, y=105, color=0xFFFFFF)
 
         self.time_text = bitmap_label.Label(terminalio.FONT, text="", x=125, y=105, color=0xFFFFFF)
+        # the time label is 20 chars wide, "Last update" goes on its own line
+        self._time_format = "Last update\n%02d/%02d/%04d %02d:%02d:%02d"
+
+    @staticmethod
+    def _set_text(label: bitmap_label.Label, text: str) -> None:
+        # assigning the text regenerates the glyphs bitmap, skip it if nothing has changed
+        if label.text != text:
+            label.text = text
 
     def update_time(self, datetime=None) -> None:
         now = time.localtime()
@@ -96,9 +166,10 @@ class TempHumidityDisplay:
         #     datetime = now
         # year, mon, day, hour, minute, seconds, *_ = datetime
         year, mon, day, hour, minute, seconds, *_ = now
-        clock_view = "%02d:%02d:%02d" % (hour, minute, seconds)
 
-        self.time_text.text = "\n".join(wrap_text_to_lines("Last update %s/%s/%s %s" % (mon, day, year, clock_view), 20))
+        # zero padded "mm/dd/yyyy hh:mm:ss" is always 19 chars, so it fits the second line
+        # and the text never has to be wrapped at runtime
+        self.time_text.text = self._time_format % (mon, day, year, hour, minute, seconds)
 
     def update_ip_address(self, ip_address) -> None:
         self.ip_address_text.text = ip_address
@@ -121,27 +192,67 @@ class TempHumidityDisplay:
             self.display.root_group = group
 
     def update(self, temp, humidity, pressure) -> None:
-        self.temp_text.text = self.temp_format % temp
-        self.humid_text.text = self.humidity_format % humidity
-        self.press_text.text = self.pressure_format % pressure
+        self._set_text(self.temp_text, self.temp_format(temp))
+        self._set_text(self.humid_text, self.humidity_format(humidity))
+        self._set_text(self.press_text, self.pressure_format(pressure))
 
-    def update_bme680(self, bme680: Optional[adafruit_bme680.Adafruit_BME680_I2C]) -> None:
-        if not bme680:
+    def update_bme680(self, measurement: "Optional[Tuple[float, float, float]]") -> None:
+        if not measurement:
             return
 
-        self.temp_text.text = self.temp_format % bme680.temperature
-        self.humid_text.text = self.humidity_format % bme680.relative_humidity
-        self.press_text.text = self.pressure_format % bme680.pressure
+        temperature, relative_humidity, pressure = measurement
+
+        self._set_text(self.temp_text, self.temp_format(temperature))
+        self._set_text(self.humid_text, self.humidity_format(relative_humidity))
+        self._set_text(self.press_text, self.pressure_format(pressure))
 
-    def update_scd4x(self, scd4x: Optional[adafruit_scd4x.SCD4X]) -> None:
-        if not scd4x:
+    def update_scd4x(self, measurement: "Optional[Tuple[int, float, float]]") -> None:
+        if not measurement:
             return
 
-        self.temp_text.text = self.temp_format % scd4x.temperature
-        self.humid_text.text = self.humidity_format % scd4x.relative_humidity
+        _, temperature, relative_humidity = measurement
+
+        self._set_text(self.temp_text, self.temp_format(temperature))
+        self._set_text(self.humid_text, self.humidity_format(relative_humidity))
+
+
+# Labels shared by all metrics of a sensor. They are passed to SensorMetric as is and treated as frozen,
+# nothing in the read path mutates them.
+BME680_SENSOR_TYPE_LABELS = {"sensor_type": "bme680"}
+BME680_INFO_LABELS = {"sensor_name": "BME680", "sensor_type": "bme680"}
+SCD4X_SENSOR_TYPE_LABELS = {"sensor_type": "scd4x"}
+
+
+_SCD4X_READ_MEASUREMENT = b"\xec\x05"
+
+
+def _sensirion_crc8(buf: bytearray, offset: int) -> int:
+    # CRC-8 (polynomial 0x31, init 0xff) of the 2 bytes word at `offset`, computed without slicing the buffer
+    crc = 0xFF
+    for i in range(offset, offset + 2):
+        crc ^= buf[i]
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x31) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+
+def render_labels(labels: "Dict") -> str:
+    # plain concatenation of short strings is cheaper than f-strings or % formatting on CircuitPython
+    return ", ".join(k + '="' + str(v) + '"' for k, v in labels.items())
+
+
+# `last_measurement_time{labels} ` prefixes, only the timestamp is formatted on every sample
+_BME680_LAST_MEASUREMENT_PREFIX = ("last_measurement_time{%s} " % render_labels(BME680_SENSOR_TYPE_LABELS)).encode()
+_SCD4X_LAST_MEASUREMENT_PREFIX = ("last_measurement_time{%s} " % render_labels(SCD4X_SENSOR_TYPE_LABELS)).encode()
 
 
 class SensorMetric:
+    # saves the per-instance __dict__ on CPython only, CircuitPython ignores __slots__
+    __slots__ = ("name", "description", "type", "value", "_labels", "_line_prefix", "_header")
+
     def __init__(
         self,
         name: str,
@@ -155,7 +266,31 @@ class SensorMetric:
         self.type = type
         self.value = value
 
-        self.labels = labels if labels else {}
+        # labels are shared between metrics of the same sensor and must never be mutated
+        self._labels = labels if labels else {}
+        self._line_prefix = None
+        self._header = None
+
+    @property
+    def header(self) -> bytes:
+        # name, description and type never change after init, render on first scrape and reuse
+        if self._header is None:
+            self._header = ("# HELP %s %s\n# TYPE %s %s\n" % (self.name, self.description, self.name, self.type)).encode()
+
+        return self._header
+
+    @property
+    def labels(self) -> "Dict":
+        return self._labels
+
+    @property
+    def line_prefix(self) -> bytes:
+        # `name{labels} ` part of the sample line. Labels never change after init and I2CSensorsManager
+        # reuses the metric objects across samples, so this is rendered once per metric per boot.
+        if self._line_prefix is None:
+            self._line_prefix = (self.name + "{" + render_labels(self._labels) + "} ").encode()
+
+        return self._line_prefix
 
     def __repr__(self) -> str:
         return f"SensorMetric({self.name}, {self.description}, {self.type}, {self.value}, {self.labels})"
@@ -163,18 +298,53 @@ class SensorMetric:
 
 class I2CSensorsManager:
     def __init__(self) -> None:
+        # Metric objects are created once and only their values are updated on every fresh sample,
+        # so their rendered headers and line prefixes are reused across polls.
+        labels = BME680_SENSOR_TYPE_LABELS
+        self._bme680_sample = [
+            SensorMetric("sensor_temperature_celsius", "Temperature in Celsius", "gauge", 0.0, labels=labels),
+            SensorMetric("sensor_humidity_percent", "Relative humidity in percent", "gauge", 0.0, labels=labels),
+            SensorMetric("sensor_pressure_hpa", "Pressure in hectopascal", "gauge", 0.0, labels=labels),
+            SensorMetric("sensor_gas_ohms", "Gas resistance in ohms", "gauge", 0.0, labels=labels),
+        ]
+        labels = SCD4X_SENSOR_TYPE_LABELS
+        self._scd4x_sample = [
+            SensorMetric("sensor_co2_ppm", "CO2 in parts per million", "gauge", 0, labels=labels),
+            SensorMetric("sensor_temperature_celsius", "Temperature in Celsius", "gauge", 0.0, labels=labels),
+            SensorMetric("sensor_humidity_percent", "Relative humidity in percent", "gauge", 0.0, labels=labels),
+        ]
+
+        # SCD4X measurement reply (3 words + CRCs), reused on every poll
+        self._scd4x_buf = bytearray(9)
+        self._scd4x_mv = memoryview(self._scd4x_buf)
+
+        self._last_metrics: "List[SensorMetric]" = []
+        self._last_poll_time = -SENSOR_POLL_PERIOD
+        self._measurement_time = 0.0
+
+        # sensor_info and last_measurement_time lines, they change only on sensor init or on a fresh sample,
+        # so they are rendered into `_static_block` right away instead of going through SensorMetric
+        self._bme680_info_line = b""
+        self._bme680_last_measurement_line = b""
+        self._scd4x_info_line = b""
+        self._scd4x_last_measurement_line = b""
+        self._static_block = b""
+
         self.init()
 
     def init(self) -> None:
         # i2c = board.I2C()  # uses board.SCL and board.SDA
         # i2c = board.STEMMA_I2C()  # For using the built-in STEMMA QT connector on a microcontroller
-        self._i2c = board.STEMMA_I2C()
+        # board.STEMMA_I2C() runs at 100 kHz, both BME680 and SCD4X support 400 kHz fast-mode.
+        # On Feather ESP32-S3 TFT the STEMMA QT connector is wired to board.SCL/board.SDA.
+        self._i2c = busio.I2C(board.SCL, board.SDA, frequency=I2C_FREQUENCY)
 
         # we assume there are only two sensors
         self.init_bme680()  # 0x77
         self.init_scd4x()  # 0x62
 
         self._bme680_last_measurement_time = 0
+        self._bme680_metrics = []
         self._scd4x_metrics = []
 
     def deinit(self) -> None:
@@ -189,13 +359,20 @@ class I2CSensorsManager:
 
     def init_bme680(self) -> None:
         try:
+            # the driver's default refresh_rate=10 reuses a reading for 0.1 s, enough for read_bme680()'s properties
             self.bme680 = adafruit_bme680.Adafruit_BME680_I2C(self.i2c, debug=False)
             # change this to match the location's pressure (hPa) at sea level
             self.bme680.sea_level_pressure = 1013.25
+            self._bme680_info_line = ("sensor_info{%s} 1\n" % render_labels(BME680_INFO_LABELS)).encode()
         except Exception as e:
             self.bme680 = None
+            self._bme680_info_line = b""
             print("Error initializing BME680", str(e))
 
+        self._bme680_last_measurement_line = b""
+        self._bme680_measurement = None
+        self._update_static_block()
+
     def init_scd4x(self) -> None:
         try:
             self.scd4x = adafruit_scd4x.SCD4X(self.i2c)
@@ -213,6 +390,39 @@ class I2CSensorsManager:
             self.scd4x_serial_number = ""
             print("Error initializing SCD4X", str(e))
 
+        if self.scd4x:
+            # serial number is constant per boot
+            info_labels = {
+                "sensor_name": "SCD4X",
+                "serial_number": self.scd4x_serial_number,
+                "sensor_type": "scd4x",
+            }
+            self._scd4x_info_line = ("sensor_info{%s} 1\n" % render_labels(info_labels)).encode()
+        else:
+            self._scd4x_info_line = b""
+
+        self._scd4x_last_measurement_line = b""
+        self._scd4x_measurement = None
+        # the first measurement arrives one interval after the start, don't report it as stale
+        self._scd4x_last_measurement_time = time.monotonic()
+        self._update_static_block()
+
+    def _update_static_block(self) -> None:
+        info_lines = self._bme680_info_line + self._scd4x_info_line
+        last_measurement_lines = self._bme680_last_measurement_line + self._scd4x_last_measurement_line
+
+        block = b""
+        if info_lines:
+            block += _SENSOR_INFO_HDR + info_lines
+        if last_measurement_lines:
+            block += _LAST_MEASUREMENT_HDR + last_measurement_lines
+
+        self._static_block = block
+
+    @property
+    def static_block(self) -> bytes:
+        return self._static_block
+
     def read_bme680(self) -> "List[SensorMetric]":
         sensor = self.bme680
 
@@ -220,29 +430,67 @@ class I2CSensorsManager:
             return []
 
         try:
+            # first access performs the reading, the others are computed from the cached registers
+            temperature = sensor.temperature
+            relative_humidity = sensor.relative_humidity
+            pressure = sensor.pressure
+            gas = sensor.gas
+
             self._bme680_last_measurement_time = time.monotonic()
-            self._bme680_metrics = [
-                SensorMetric("sensor_temperature_celsius", "Temperature in Celsius", "gauge", sensor.temperature),
-                SensorMetric("sensor_humidity_percent", "Relative humidity in percent", "gauge", sensor.relative_humidity),
-                SensorMetric("sensor_pressure_hpa", "Pressure in hectopascal", "gauge", sensor.pressure),
-                SensorMetric("sensor_gas_ohms", "Gas resistance in ohms", "gauge", sensor.gas),
-                # last measurement time
-                SensorMetric("last_measurement_time", "Last measurement time", "gauge", self._bme680_last_measurement_time),
-                # sensor_info
-                SensorMetric("sensor_info", "Sensor info", "gauge", 1, labels={"sensor_name": "BME680"}),
-            ]
-            metrics = self._bme680_metrics
+            metrics = self._bme680_sample
+            for metric, value in zip(metrics, (temperature, relative_humidity, pressure, gas)):
+                metric.value = value
+
+            self._bme680_metrics = metrics
+            self._bme680_measurement = (temperature, relative_humidity, pressure)
+            self._bme680_last_measurement_line = self._render_last_measurement(
+                _BME680_LAST_MEASUREMENT_PREFIX, self._bme680_last_measurement_time
+            )
+            self._update_static_block()
         except (Exception, RuntimeError) as e:
             print("Error reading BME680", str(e))
-            metrics = [m for m in getattr(self, "_bme680_metrics", [])]
-
-            metrics.append(SensorMetric("sensor_is_error", f"Error: {e}", "gauge", 1))
+            metrics = [m for m in self._bme680_metrics]
 
-        for metric in metrics:
-            metric.labels["sensor_type"] = "bme680"
+            metrics.append(SensorMetric("sensor_is_error", f"Error: {e}", "gauge", 1, labels=BME680_SENSOR_TYPE_LABELS))
 
         return metrics
 
+    @staticmethod
+    def _render_last_measurement(prefix: bytes, measurement_time: float) -> bytes:
+        return prefix + b"%0.3f\n" % measurement_time
+
+    def _scd4x_read_measurement(self) -> "Optional[Tuple[int, float, float]]":
+        """
+        Issues read_measurement (0xec05) directly instead of get_data_ready_status + read_measurement,
+        which saves one I2C command per poll. The reply is read into a preallocated buffer and parsed in place.
+        The sensor NACKs the read when there's no new data, so a NACK or a zero CO2 value means the data
+        is stale and None is returned. A CRC mismatch is a bus error and raises RuntimeError.
+        """
+
+        buf = self._scd4x_buf
+
+        try:
+            with self.scd4x.i2c_device as i2c:
+                i2c.write(_SCD4X_READ_MEASUREMENT)
+                time.sleep(0.001)
+                i2c.readinto(self._scd4x_mv)
+        except OSError:
+            return None
+
+        # reply is 3 words of 2 data bytes followed by their CRC
+        for i in range(0, 9, 3):
+            if _sensirion_crc8(buf, i) != buf[i + 2]:
+                raise RuntimeError("SCD4X CRC mismatch")
+
+        co2 = (buf[0] << 8) | buf[1]
+        if co2 == 0:
+            return None
+
+        temperature = -45 + 175 * (((buf[3] << 8) | buf[4]) / 65536)
+        relative_humidity = 100 * (((buf[6] << 8) | buf[7]) / 65536)
+
+        return (co2, temperature, relative_humidity)
+
     def read_scd4x(self) -> "List[SensorMetric]":
         """
         SC4DX sensor metrics are not very stable, so when we read the sensor data, runtime errors can occur.
@@ -255,37 +503,50 @@ class I2CSensorsManager:
             return []
 
         try:
-            if sensor.data_ready:
-                sensor_info_labels = {
-                    "sensor_name": "SCD4X",
-                    "serial_number": self.scd4x_serial_number,
-                }
-
-                metrics = [
-                    SensorMetric("sensor_co2_ppm", "CO2 in parts per million", "gauge", sensor.CO2),
-                    SensorMetric("sensor_temperature_celsius", "Temperature in Celsius", "gauge", sensor.temperature),
-                    SensorMetric("sensor_humidity_percent", "Relative humidity in percent", "gauge", sensor.relative_humidity),
-                    # last measurement time
-                    SensorMetric("last_measurement_time", "Last measurement time", "gauge", time.monotonic()),
-                    # sensor_info
-                    SensorMetric("sensor_info", "Sensor info", "gauge", 1, labels=sensor_info_labels),
-                ]
+            measurement = self._scd4x_read_measurement()
+            if measurement:
+                metrics = self._scd4x_sample
+                for metric, value in zip(metrics, measurement):
+                    metric.value = value
 
                 self._scd4x_metrics = metrics
+                self._scd4x_measurement = measurement
+                self._scd4x_last_measurement_time = time.monotonic()
+                self._scd4x_last_measurement_line = self._render_last_measurement(
+                    _SCD4X_LAST_MEASUREMENT_PREFIX, self._scd4x_last_measurement_time
+                )
+                self._update_static_block()
+            elif time.monotonic() - self._scd4x_last_measurement_time > SCD4X_STALE_TIMEOUT:
+                raise RuntimeError("No fresh measurement for %d seconds" % SCD4X_STALE_TIMEOUT)
             else:
-                metrics = getattr(self, "_scd4x_metrics", [])
+                metrics = self._scd4x_metrics
         except (Exception, RuntimeError) as e:
             print("Error reading SCD4X", str(e))
-            metrics = [m for m in getattr(self, "_scd4x_metrics", [])]
+            metrics = [m for m in self._scd4x_metrics]
 
-            metrics.append(SensorMetric("sensor_is_error", f"Error: {e}", "gauge", 1))
-
-        for metric in metrics:
-            metric.labels["sensor_type"] = "scd4x"
+            metrics.append(SensorMetric("sensor_is_error", f"Error: {e}", "gauge", 1, labels=SCD4X_SENSOR_TYPE_LABELS))
 
         return metrics
 
-    def read_metrics(self) -> "List[SensorMetric]":
+    @property
+    def bme680_measurement(self) -> "Optional[Tuple[float, float, float]]":
+        """
+        Last (temperature, relative_humidity, pressure) read by read_bme680(). Reading the driver properties
+        would start another forced-mode measurement outside tick(), so the display uses this instead.
+        """
+
+        return self._bme680_measurement
+
+    @property
+    def scd4x_measurement(self) -> "Optional[Tuple[int, float, float]]":
+        """
+        Last (co2, temperature, relative_humidity) parsed by read_scd4x(). The measurements are read past the
+        driver, so its properties never get fresh values and must not be used for display.
+        """
+
+        return self._scd4x_measurement
+
+    def sample_metrics(self) -> "List[SensorMetric]":
         metrics = []
 
         metrics.extend(self.read_bme680())
@@ -293,6 +554,29 @@ class I2CSensorsManager:
 
         return metrics
 
+    def tick(self, now: float) -> None:
+        """
+        Polls the sensors from the main loop every SENSOR_POLL_PERIOD seconds,
+        so HTTP handlers never wait for the I2C bus.
+        """
+
+        if now - self._last_poll_time < SENSOR_POLL_PERIOD:
+            return
+
+        start_time = time.monotonic()
+
+        self._last_metrics = self.sample_metrics()
+        self._last_poll_time = now
+        self._measurement_time = time.monotonic() - start_time
+
+    def snapshot_metrics(self) -> "List[SensorMetric]":
+        # doesn't touch the I2C bus, returns metrics sampled by the last tick()
+        return self._last_metrics
+
+    @property
+    def measurement_time(self) -> float:
+        return self._measurement_time
+
 
 i2c_sm = I2CSensorsManager()
 
@@ -304,75 +588,100 @@ last_discovery_time = time.monotonic()
 last_screen_update_time = time.monotonic()
 
 
-@server.route("/metrics", append_slash=True)
-def metrics_handler(request: Request) -> Response:
-    print("Received request for metrics")
-
-    response_text = ""
-
-    start_time = time.monotonic()
-
-    metrics = i2c_sm.read_metrics()
+def metrics_lines() -> "Generator[bytes, None, None]":
+    metrics = i2c_sm.snapshot_metrics()
 
+    # Prometheus expects HELP/TYPE once per metric family, while e.g. sensor_temperature_celsius
+    # comes from both sensors. Dicts are not ordered on CircuitPython, so keep the order in a list.
+    names = []
+    by_name = {}
     for metric in metrics:
-        response_text += "# HELP %s %s\n" % (metric.name, metric.description)
-        response_text += "# TYPE %s %s\n" % (metric.name, metric.type)
-        labels = ", ".join([f'{k}="{v}"' for k, v in metric.labels.items()])
-        response_text += "%s{%s} %0.3f\n" % (metric.name, labels, metric.value)
+        if metric.name not in by_name:
+            names.append(metric.name)
+            by_name[metric.name] = []
+        by_name[metric.name].append(metric)
+
+    for name in names:
+        group = by_name[name]
+        yield group[0].header
+        for metric in group:
+            yield metric.line_prefix
+            yield b"%0.3f\n" % metric.value
 
-    measurement_time = time.monotonic() - start_time
+    # sensor_info and last_measurement_time are pre-rendered by the sensors manager
+    yield i2c_sm.static_block
 
-    response_text += "# HELP microcontroller_measurement_time_seconds Time to measure metrics in seconds\n"
-    response_text += "# TYPE microcontroller_measurement_time_seconds gauge\n"
-    response_text += "microcontroller_measurement_time_seconds %0.3f\n" % measurement_time
+    yield _MEASUREMENT_TIME_HDR
+    yield b"microcontroller_measurement_time_seconds %0.3f\n" % i2c_sm.measurement_time
 
     if hasattr(microcontroller, "cpus"):
         cpus = microcontroller.cpus
     else:
         cpus = [microcontroller.cpu]
 
+    yield _CPU_TEMP_HDR
     for cpu_id, cpu in enumerate(cpus):
-        response_text += "# HELP microcontroller_cpu_temperature_celsius TemperatuPre in Celsius\n"
-        response_text += "# TYPE microcontroller_cpu_temperature_celsius gauge\n"
-        response_text += 'microcontroller_cpu_temperature_celsius{cpu="%s"} %0.1f\n' % (cpu_id, cpu.temperature)
+        yield b'microcontroller_cpu_temperature_celsius{cpu="%d"} %0.1f\n' % (cpu_id, cpu.temperature)
 
-        response_text += "# HELP microcontroller_cpu_frequency_hz Frequency in hertz\n"
-        response_text += "# TYPE microcontroller_cpu_frequency_hz gauge\n"
-        response_text += 'microcontroller_cpu_frequency_hz{cpu="%s"} %d\n' % (cpu_id, cpu.frequency)
+    yield _CPU_FREQ_HDR
+    for cpu_id, cpu in enumerate(cpus):
+        yield b'microcontroller_cpu_frequency_hz{cpu="%d"} %d\n' % (cpu_id, cpu.frequency)
 
-    response_text += "# HELP microcontroller_last_discovery_time_seconds Last discovery time in seconds\n"
-    response_text += "# TYPE microcontroller_last_discovery_time_seconds gauge\n"
-    response_text += "microcontroller_last_discovery_time_seconds %0.3f\n" % last_discovery_time
+    yield _LAST_DISCOVERY_HDR
+    yield b"microcontroller_last_discovery_time_seconds %0.3f\n" % last_discovery_time
 
-    response_text += "# HELP microcontroller_next_discovery_time_seconds Next discovery time in seconds\n"
-    response_text += "# TYPE microcontroller_next_discovery_time_seconds gauge\n"
-    response_text += "microcontroller_next_discovery_time_seconds %0.3f\n" % (DISCOVERY_PERIOD - (time.monotonic() - last_discovery_time))
+    yield _NEXT_DISCOVERY_HDR
+    yield b"microcontroller_next_discovery_time_seconds %0.3f\n" % (DISCOVERY_PERIOD - (time.monotonic() - last_discovery_time))
 
-    response_text += "# HELP microcontroller_last_screen_update_time_seconds Last screen update time in seconds\n"
-    response_text += "# TYPE microcontroller_last_screen_update_time_seconds gauge\n"
-    response_text += "microcontroller_last_screen_update_time_seconds %0.3f\n" % last_screen_update_time
+    yield _LAST_SCREEN_UPDATE_HDR
+    yield b"microcontroller_last_screen_update_time_seconds %0.3f\n" % last_screen_update_time
 
     # microcontroller_info
+    yield _INFO_BLOCK
 
-    try:
-        info_labels = {
-            "cpu_frequency": microcontroller.cpu.frequency,
-            "board_id": os.uname().machine,
-            "board_name": board.board_id,
-            "nvm_bytes_count": len(microcontroller.nvm),
-        }
-    except AttributeError:
-        raise
-        # info_labels = {}
-        # pass
 
-    info_labels_str = ", ".join([f'{k}="{v}"' for k, v in info_labels.items()])
+def buffered_chunks(lines: "Iterable[bytes]", size: int = METRICS_CHUNK_SIZE) -> "Generator[memoryview, None, None]":
+    """
+    Copies small lines into one preallocated buffer and yields it when it's full, so we don't send a tiny
+    HTTP chunk per line and never hold the whole response in memory.
+    The yielded view is reused for the next chunk, so it must be sent before the generator is resumed.
+    """
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    length = 0
+
+    for line in lines:
+        line_length = len(line)
+
+        if length + line_length > size:
+            if length:
+                yield view[:length]
+                length = 0
+
+            # doesn't fit the buffer at all, send it as is
+            if line_length > size:
+                yield line
+                continue
+
+        view[length : length + line_length] = line
+        length += line_length
+
+    if length:
+        yield view[:length]
 
-    response_text += "# HELP microcontroller_info Microcontroller info\n"
-    response_text += "# TYPE microcontroller_info gauge\n"
-    response_text += "microcontroller_info{%s} 1\n" % info_labels_str
 
-    return Response(request, response_text)
+@server.route("/metrics", append_slash=True)
+def metrics_handler(request: Request) -> ChunkedResponse:
+    print("Received request for metrics")
+
+    # The body is generated lazily while sending, so the whole response is never kept in RAM.
+    # It is never gzipped even if the scraper sends Accept-Encoding: gzip, CircuitPython's zlib
+    # can only decompress (no compressobj), so there is no compressor to feed the chunks to.
+    def body() -> "Generator[memoryview, None, None]":
+        return buffered_chunks(metrics_lines())
+
+    return ChunkedResponse(request, body, content_type=METRICS_CONTENT_TYPE)
 
 
 #  initialize display
@@ -381,6 +690,10 @@ temp_humidity_display.init()
 temp_humidity_display.update_ip_address(str(wifi.radio.ipv4_address))
 
 MAIN_LOOP_DELAY = 0.1
+# shorter delay while HTTP clients are active, so requests are not delayed by up to MAIN_LOOP_DELAY
+MAIN_LOOP_ACTIVE_DELAY = 0.005
+# how long after the last request the loop stays in the active mode
+MAIN_LOOP_ACTIVE_PERIOD = 0.5  # seconds
 
 # clocks to countdown
 DISPLAY_UPDATE_INTERVAL = 10  # seconds
@@ -389,6 +702,8 @@ DISCOVERY_PERIOD = 360  # seconds
 
 server.start(str(wifi.radio.ipv4_address))
 
+last_activity_time = time.monotonic()
+
 while True:
     current_time = time.monotonic()
     if current_time - last_discovery_time > DISCOVERY_PERIOD:
@@ -397,22 +712,32 @@ while True:
 
         last_discovery_time = current_time
 
+    # feed the watchdog after every phase which may block on I2C or network,
+    # so the time between feeds is bounded by the slowest phase, not by the whole loop
+    i2c_sm.tick(current_time)
+    w.feed()
+
     try:
         pool_result = server.poll()
-        if pool_result is not None:
+        # poll() returns NO_REQUEST on idle loops, only a handled request counts as activity
+        if pool_result != NO_REQUEST:
             print("pool_result", pool_result)
+        if pool_result == REQUEST_HANDLED_RESPONSE_SENT:
+            last_activity_time = current_time
 
     except OSError as e:
         print("pool_result error", e)
+    w.feed()
 
     if current_time - last_screen_update_time > DISPLAY_UPDATE_INTERVAL:
         try:
             if i2c_sm.bme680:
-                temp_humidity_display.update_bme680(i2c_sm.bme680)
+                temp_humidity_display.update_bme680(i2c_sm.bme680_measurement)
             elif i2c_sm.scd4x:
-                temp_humidity_display.update_scd4x(i2c_sm.scd4x)
+                temp_humidity_display.update_scd4x(i2c_sm.scd4x_measurement)
         except (Exception, RuntimeError):
             pass
+        w.feed()
 
         try:
             temp_humidity_display.update_time()
@@ -424,6 +749,13 @@ while True:
             continue
 
         last_screen_update_time = current_time
+        w.feed()
 
-    time.sleep(MAIN_LOOP_DELAY)
+    if current_time - last_activity_time < MAIN_LOOP_ACTIVE_PERIOD:
+        delay = MAIN_LOOP_ACTIVE_DELAY
+    else:
+        delay = MAIN_LOOP_DELAY
+
+    w.feed()
+    time.sleep(delay)
     w.feed()